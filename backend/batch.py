@@ -0,0 +1,288 @@
+# backend/batch.py
+"""
+离线批量回测
+
+从 stocks 表（stocks.db 或 PostgreSQL）读取证券列表，从本地价格矩阵（见 universe.py）
+读取行情，多进程并行运行定投回测，结果写入列式文件。
+
+- 证券按固定大小分块，每块完成后立即写入检查点目录，中断后重新运行会跳过已完成的块
+- 输出为 Parquet（需要 pyarrow），输出文件以 .csv 结尾时写 CSV
+- 未指定 --end 时沿用检查点中记录的结束日期，没有检查点时使用当天
+
+用法（在 backend 目录下）：
+    python universe.py build --end 2025-01-01
+    python batch.py --start 2015-01-01 --end 2025-01-01 --out results.parquet
+"""
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import pandas as pd
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Any, Dict, List, Optional, Tuple
+from engine import run_backtest_on_column
+from universe import DEFAULT_DB_PATH, UNIVERSE_DIR, UniversePrices, load_catalog, resolve_universe_dir
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+# 直接取自回测结果 summary() 的标量指标
+METRIC_FIELDS = [
+    'total_invested', 'final_total', 'total_return_pct', 'absolute_profit',
+    'max_drawdown_pct', 'xirr_pct', 'annualized_return_pct', 'annualized_volatility_pct',
+    'sharpe_ratio', 'sortino_ratio', 'longest_drawdown_days', 'max_drawdown_recovery_days',
+    'total_investments',
+]
+
+# 结果文件的列
+RESULT_FIELDS = ['symbol', 'market', 'success', 'error'] + METRIC_FIELDS + ['trading_days', 'first_date', 'last_date']
+
+# 计数列，失败的证券为空值
+COUNT_FIELDS = ['total_investments', 'trading_days']
+
+# 每一列的固定类型：失败证券的指标全为空时，各块文件的类型仍然一致
+RESULT_DTYPES = {
+    'symbol': 'string',
+    'market': 'string',
+    'success': 'bool',
+    'error': 'string',
+    **{field: 'float64' for field in METRIC_FIELDS if field not in COUNT_FIELDS},
+    **{field: 'Int64' for field in COUNT_FIELDS},
+    'first_date': 'string',
+    'last_date': 'string',
+}
+
+PARAMS_FILE = 'params.json'
+
+# 工作进程内共享的价格矩阵和回测参数
+_universe: Optional[UniversePrices] = None
+_params: Dict[str, Any] = {}
+
+def _init_worker(universe_dir: str, params: Dict[str, Any]) -> None:
+    """工作进程初始化：打开内存映射价格矩阵（各进程共享页缓存）"""
+    global _universe, _params
+    _universe = UniversePrices(universe_dir)
+    _params = params
+
+def _backtest_symbol(symbol: str, market: str) -> Dict[str, Any]:
+    """回测单个证券，失败时返回带错误信息的行"""
+    row = {'symbol': symbol, 'market': market, 'success': False, 'error': None}
+    try:
+        if symbol not in _universe:
+            raise ValueError("价格矩阵中没有该证券")
+
+        # 直接在内存映射的价格列上回测，不构造 DataFrame
+        close = _universe.column(symbol, _params['start_date'], _params['end_date'])
+        dates = _universe.column_dates(_params['start_date'], _params['end_date'])
+        result = run_backtest_on_column(dates, close, _params['initial_investment'], _params['monthly_investment'])
+
+        summary = result.summary()
+        for field in METRIC_FIELDS:
+            row[field] = summary[field]
+        row['trading_days'] = result.trading_days
+        row['first_date'] = result.axis.index[0].strftime('%Y-%m-%d')
+        row['last_date'] = result.axis.index[-1].strftime('%Y-%m-%d')
+        row['success'] = True
+    except Exception as e:
+        row['error'] = str(e)
+    return row
+
+def _part_path(checkpoint_dir: str, chunk_id: int, fmt: str) -> str:
+    return os.path.join(checkpoint_dir, f'part-{chunk_id:05d}.{fmt}')
+
+def _write_table(frame: pd.DataFrame, path: str, fmt: str) -> None:
+    """先写临时文件再原子替换，中断时不会留下半个文件"""
+    tmp_path = path + '.tmp'
+    if fmt == 'parquet':
+        frame.to_parquet(tmp_path, index=False)
+    else:
+        frame.to_csv(tmp_path, index=False)
+    os.replace(tmp_path, path)
+
+def _read_table(path: str, fmt: str) -> pd.DataFrame:
+    frame = pd.read_parquet(path) if fmt == 'parquet' else pd.read_csv(path)
+    return frame.astype(RESULT_DTYPES)
+
+def _run_chunk(chunk_id: int, chunk: List[Tuple[str, str]], checkpoint_dir: str, fmt: str) -> Tuple[int, int, int]:
+    """
+    回测一块证券并写入检查点
+    :return: (块编号, 证券数, 成功数)
+    """
+    rows = [_backtest_symbol(symbol, market) for symbol, market in chunk]
+    frame = pd.DataFrame(rows, columns=RESULT_FIELDS).astype(RESULT_DTYPES)
+    _write_table(frame, _part_path(checkpoint_dir, chunk_id, fmt), fmt)
+    return chunk_id, len(rows), int(frame['success'].sum())
+
+def _prepare_checkpoint(checkpoint_dir: str, params: Dict[str, Any], restart: bool) -> None:
+    """
+    准备检查点目录；参数（包括价格矩阵的构建目录）与已有检查点不一致时拒绝续跑，
+    避免混入不同参数或不同构建的结果
+    """
+    params_path = os.path.join(checkpoint_dir, PARAMS_FILE)
+    if restart and os.path.isdir(checkpoint_dir):
+        shutil.rmtree(checkpoint_dir)
+    os.makedirs(checkpoint_dir, exist_ok=True)
+
+    if os.path.exists(params_path):
+        with open(params_path, encoding='utf-8') as f:
+            previous = json.load(f)
+        if previous != params:
+            raise ValueError(f"检查点 {checkpoint_dir} 的参数与本次不一致，请使用 --restart 重新开始")
+    else:
+        with open(params_path, 'w', encoding='utf-8') as f:
+            json.dump(params, f, ensure_ascii=False, indent=2)
+
+def run_batch(
+    catalog: List[Tuple[str, str]],
+    start_date: str,
+    end_date: str,
+    initial_investment: float,
+    monthly_investment: float,
+    out_path: str,
+    universe_dir: str = UNIVERSE_DIR,
+    checkpoint_dir: Optional[str] = None,
+    chunk_size: int = 100,
+    workers: Optional[int] = None,
+    restart: bool = False
+) -> pd.DataFrame:
+    """
+    对证券列表执行批量回测
+    :param catalog: [(symbol, market), ...]
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param initial_investment: 初始投资金额
+    :param monthly_investment: 每月定投金额
+    :param out_path: 输出文件路径（.parquet 或 .csv）
+    :param universe_dir: 价格矩阵目录
+    :param checkpoint_dir: 检查点目录，默认为 out_path + '.parts'
+    :param chunk_size: 每块证券数
+    :param workers: 进程数，默认 CPU 核数
+    :param restart: 是否丢弃已有检查点重新开始
+    :return: 全部结果
+    """
+    if not catalog:
+        raise ValueError("证券列表不能为空")
+
+    fmt = 'csv' if out_path.endswith('.csv') else 'parquet'
+    if fmt == 'parquet' and pyarrow is None:
+        raise ValueError("写入 Parquet 需要安装 pyarrow，或将输出文件改为 .csv")
+    checkpoint_dir = checkpoint_dir or out_path + '.parts'
+    workers = workers or os.cpu_count() or 1
+
+    # 只解析一次 current 链接：记录到检查点参数中，所有工作进程也读取同一次构建
+    universe_dir = os.path.realpath(resolve_universe_dir(universe_dir))
+
+    params = {
+        'start_date': start_date,
+        'end_date': end_date,
+        'initial_investment': initial_investment,
+        'monthly_investment': monthly_investment,
+        'chunk_size': chunk_size,
+        'format': fmt,
+        'universe_build': universe_dir,
+        'symbols_hash': hashlib.sha256('\n'.join(s for s, _ in catalog).encode('utf-8')).hexdigest(),
+    }
+    _prepare_checkpoint(checkpoint_dir, params, restart)
+
+    chunks = [catalog[i:i + chunk_size] for i in range(0, len(catalog), chunk_size)]
+    pending = [i for i in range(len(chunks)) if not os.path.exists(_part_path(checkpoint_dir, i, fmt))]
+    total = sum(len(chunks[i]) for i in pending)
+    skipped = len(catalog) - total
+    print(f"共 {len(catalog)} 个证券，{len(chunks)} 块，已完成 {len(chunks) - len(pending)} 块，使用 {workers} 个进程")
+
+    started = time.time()
+    processed = 0
+    succeeded = 0
+    if pending:
+        worker_params = {k: params[k] for k in ('start_date', 'end_date', 'initial_investment', 'monthly_investment')}
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(universe_dir, worker_params)) as executor:
+            futures = [executor.submit(_run_chunk, i, chunks[i], checkpoint_dir, fmt) for i in pending]
+
+            for future in as_completed(futures):
+                _, count, ok = future.result()
+                processed += count
+                succeeded += ok
+                elapsed = time.time() - started
+                rate = processed / elapsed if elapsed > 0 else 0.0
+                eta = (total - processed) / rate if rate > 0 else 0.0
+                print(f"进度 {skipped + processed} / {len(catalog)}，成功 {succeeded}，"
+                      f"{rate:.1f} 个/秒，预计剩余 {eta / 60:.1f} 分钟")
+
+    # 合并所有块
+    results = pd.concat(
+        [_read_table(_part_path(checkpoint_dir, i, fmt), fmt) for i in range(len(chunks))],
+        ignore_index=True
+    )
+    _write_table(results, out_path, fmt)
+
+    elapsed = time.time() - started
+    print(f"✅ 完成 {len(results)} 个证券（本次 {processed} 个，用时 {elapsed:.1f} 秒），"
+          f"成功 {int(results['success'].sum())} 个，结果已写入 {out_path}")
+    return results
+
+def _checkpoint_end_date(checkpoint_dir: str) -> Optional[str]:
+    """读取已有检查点记录的结束日期，没有检查点时返回 None"""
+    params_path = os.path.join(checkpoint_dir, PARAMS_FILE)
+    if not os.path.exists(params_path):
+        return None
+    with open(params_path, encoding='utf-8') as f:
+        return json.load(f).get('end_date')
+
+def _read_symbols_file(path: str, catalog: List[Tuple[str, str]]) -> List[Tuple[str, str]]:
+    """读取每行一个代码的证券列表，市场信息从目录中补全"""
+    markets = dict(catalog)
+    with open(path, encoding='utf-8') as f:
+        symbols = [line.strip() for line in f if line.strip() and not line.startswith('#')]
+    return [(symbol, markets.get(symbol, '')) for symbol in dict.fromkeys(symbols)]
+
+def main():
+    parser = argparse.ArgumentParser(description="离线批量定投回测")
+    parser.add_argument('--db', default=DEFAULT_DB_PATH, help="SQLite 证券目录文件")
+    parser.add_argument('--database-url', default=None, help="PostgreSQL 连接串（优先于 --db）")
+    parser.add_argument('--market', default=None, help="只回测指定市场，如 US、A-Share")
+    parser.add_argument('--symbols-file', default=None, help="每行一个代码的证券列表，替代整个目录")
+    parser.add_argument('--start', required=True, help="开始日期")
+    parser.add_argument('--end', default=None, help="结束日期，默认沿用检查点中的结束日期，没有检查点时为当天")
+    parser.add_argument('--initial', type=float, default=10000, help="初始投资金额")
+    parser.add_argument('--monthly', type=float, default=1000, help="每月定投金额")
+    parser.add_argument('--universe', default=UNIVERSE_DIR, help="价格矩阵目录")
+    parser.add_argument('--out', default='backtest_results.parquet', help="输出文件（.parquet 或 .csv）")
+    parser.add_argument('--checkpoint-dir', default=None, help="检查点目录，默认为 <out>.parts")
+    parser.add_argument('--chunk-size', type=int, default=100, help="每块证券数")
+    parser.add_argument('--workers', type=int, default=None, help="进程数，默认 CPU 核数")
+    parser.add_argument('--restart', action='store_true', help="丢弃已有检查点重新开始")
+    args = parser.parse_args()
+
+    # 跨天续跑时不能用新的"当天"作为结束日期，否则参数与检查点不一致
+    end_date = args.end
+    if end_date is None and not args.restart:
+        end_date = _checkpoint_end_date(args.checkpoint_dir or args.out + '.parts')
+        if end_date:
+            print(f"沿用检查点的结束日期 {end_date}")
+    end_date = end_date or datetime.now().strftime('%Y-%m-%d')
+
+    catalog = load_catalog(args.db, args.database_url, args.market)
+    if args.symbols_file:
+        catalog = _read_symbols_file(args.symbols_file, catalog)
+
+    try:
+        run_batch(
+            catalog, args.start, end_date, args.initial, args.monthly, args.out,
+            universe_dir=args.universe,
+            checkpoint_dir=args.checkpoint_dir,
+            chunk_size=args.chunk_size,
+            workers=args.workers,
+            restart=args.restart
+        )
+    except ValueError as e:
+        print(f"❌ {e}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
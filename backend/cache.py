@@ -0,0 +1,245 @@
+# backend/cache.py
+import os
+import json
+import time
+import pickle
+import sqlite3
+import hashlib
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from typing import Any, Optional
+from http_cache import DATA_VERSION
+
+# 缓存键结构版本：缓存值的格式变化时修改该值；DATA_VERSION 变化同样会使旧键失效
+CACHE_SCHEMA_VERSION = '3'
+
+def make_key(namespace: str, *parts: Any) -> str:
+    """
+    生成带版本号的缓存键
+    :param namespace: 命名空间，如 'prices'、'backtest'
+    :param parts: 决定缓存内容的参数
+    :return: 形如 'prices:v3.1:<hash>' 的缓存键
+    """
+    payload = json.dumps(parts, ensure_ascii=False, separators=(',', ':'), default=str)
+    digest = hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+    return f"{namespace}:v{CACHE_SCHEMA_VERSION}.{DATA_VERSION}:{digest}"
+
+class CacheBackend(ABC):
+    """
+    缓存后端接口，用于缓存下载的行情数据和回测结果
+    get 返回的对象可能被其他请求共享，调用方应视为只读
+    """
+
+    @abstractmethod
+    def get(self, key: str) -> Optional[Any]:
+        """读取缓存，未命中或已过期返回 None"""
+        ...
+
+    @abstractmethod
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        """写入缓存，ttl 为秒数，None 表示不过期"""
+        ...
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        """删除缓存"""
+        ...
+
+    @abstractmethod
+    def clear(self) -> None:
+        """清空缓存"""
+        ...
+
+class MemoryCache(CacheBackend):
+    """进程内 LRU 缓存，只在当前 worker 内有效"""
+
+    def __init__(self, max_entries: int = 256):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires_at = entry
+            if expires_at is not None and expires_at <= time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        expires_at = time.time() + ttl if ttl is not None else None
+        with self._lock:
+            self._entries[key] = (value, expires_at)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+class SQLiteCache(CacheBackend):
+    """
+    基于本地 SQLite 文件的共享缓存，同一主机上的所有 worker 进程共用
+    使用 WAL 模式和内存映射读取，读操作互不阻塞；写入和淘汰在同一个
+    IMMEDIATE 事务中完成，多进程并发时不会互相踩踏
+    """
+
+    # 访问时间的更新粒度（秒），避免每次读取都产生写操作
+    ACCESS_RESOLUTION = 60
+
+    def __init__(self, path: str, max_entries: int = 2000, timeout: float = 10.0):
+        self.path = path
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                key TEXT PRIMARY KEY,
+                value BLOB NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_accessed ON cache_entries(accessed_at)")
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_cache_expires ON cache_entries(expires_at)")
+
+    def _connect(self, name: str = 'conn', timeout: Optional[float] = None) -> sqlite3.Connection:
+        """
+        获取当前线程的连接（fork 出的子进程会重新建立连接）
+        :param name: 连接名，不同用途的连接各自独立
+        :param timeout: 等待写锁的秒数，默认为 self.timeout
+        """
+        conn = getattr(self._local, name, None)
+        if conn is not None and getattr(self._local, name + '_pid', None) == os.getpid():
+            return conn
+
+        conn = sqlite3.connect(self.path, timeout=self.timeout if timeout is None else timeout, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA mmap_size=268435456")
+        setattr(self._local, name, conn)
+        setattr(self._local, name + '_pid', os.getpid())
+        return conn
+
+    def _touch(self, key: str, now: float) -> None:
+        """
+        更新访问时间；使用不等待锁的独立连接（timeout=0），
+        其他进程正在写入时立即放弃，不会阻塞读请求
+        """
+        try:
+            self._connect('touch_conn', timeout=0).execute(
+                "UPDATE cache_entries SET accessed_at = ? WHERE key = ?", (now, key)
+            )
+        except sqlite3.OperationalError:
+            # 其他进程正在写入，跳过本次访问时间更新
+            pass
+
+    def get(self, key: str) -> Optional[Any]:
+        try:
+            conn = self._connect()
+            row = conn.execute(
+                "SELECT value, expires_at, accessed_at FROM cache_entries WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+
+            value, expires_at, accessed_at = row
+            now = time.time()
+            if expires_at is not None and expires_at <= now:
+                return None
+
+            if now - accessed_at > self.ACCESS_RESOLUTION:
+                self._touch(key, now)
+            return pickle.loads(value)
+        except Exception as e:
+            # 缓存故障不能影响正常请求，按未命中处理
+            print(f"⚠️ 读取缓存失败: {e}")
+            return None
+
+    def set(self, key: str, value: Any, ttl: Optional[float] = None) -> None:
+        now = time.time()
+        expires_at = now + ttl if ttl is not None else None
+        try:
+            blob = pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL)
+            conn = self._connect()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                conn.execute(
+                    "INSERT OR REPLACE INTO cache_entries (key, value, expires_at, accessed_at) VALUES (?, ?, ?, ?)",
+                    (key, sqlite3.Binary(blob), expires_at, now)
+                )
+                self._evict(conn, now)
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        except Exception as e:
+            print(f"⚠️ 写入缓存失败: {e}")
+
+    def _evict(self, conn: sqlite3.Connection, now: float) -> None:
+        """删除过期条目，并按最近访问时间淘汰超出容量的条目（需在写事务中调用）"""
+        conn.execute("DELETE FROM cache_entries WHERE expires_at IS NOT NULL AND expires_at <= ?", (now,))
+        count = conn.execute("SELECT COUNT(*) FROM cache_entries").fetchone()[0]
+        if count > self.max_entries:
+            conn.execute(
+                "DELETE FROM cache_entries WHERE key IN "
+                "(SELECT key FROM cache_entries ORDER BY accessed_at LIMIT ?)",
+                (count - self.max_entries,)
+            )
+
+    def delete(self, key: str) -> None:
+        try:
+            self._connect().execute("DELETE FROM cache_entries WHERE key = ?", (key,))
+        except Exception as e:
+            print(f"⚠️ 删除缓存失败: {e}")
+
+    def clear(self) -> None:
+        try:
+            self._connect().execute("DELETE FROM cache_entries")
+        except Exception as e:
+            print(f"⚠️ 清空缓存失败: {e}")
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache() -> CacheBackend:
+    """
+    获取全局缓存后端，由环境变量配置：
+    CACHE_BACKEND: 'sqlite'（默认，同主机 worker 共享）或 'memory'（进程内）
+    CACHE_PATH: SQLite 缓存文件路径
+    CACHE_MAX_ENTRIES: 最大条目数
+    """
+    global _cache
+    with _cache_lock:
+        if _cache is not None:
+            return _cache
+
+        backend = os.getenv('CACHE_BACKEND', 'sqlite').lower()
+        max_entries = int(os.getenv('CACHE_MAX_ENTRIES', '2000'))
+
+        if backend == 'sqlite':
+            path = os.getenv('CACHE_PATH', os.path.expanduser("~/.cache/investsimulator/cache.db"))
+            try:
+                _cache = SQLiteCache(path, max_entries=max_entries)
+                print(f"✅ 使用共享SQLite缓存: {path}")
+            except Exception as e:
+                print(f"⚠️ SQLite缓存初始化失败，改用进程内缓存: {e}")
+
+        if _cache is None:
+            _cache = MemoryCache(max_entries=max_entries)
+        return _cache
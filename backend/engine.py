@@ -5,6 +5,7 @@ from datetime import datetime, timedelta
 from dateutil.relativedelta import relativedelta
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from typing import List, Dict, Any
+from metrics import compute_metrics
 
 def calculate_investment_dates(start_date: pd.Timestamp, end_date: pd.Timestamp, available_dates: pd.DatetimeIndex) -> List[pd.Timestamp]:
     """
@@ -37,169 +38,280 @@ def calculate_investment_dates(start_date: pd.Timestamp, end_date: pd.Timestamp,
     
     return investment_dates
 
-def calculate_principal_line(investment_dates: List[pd.Timestamp], 
-                           initial_investment: float, 
-                           monthly_investment: float,
-                           date_range: pd.DatetimeIndex) -> Dict[str, float]:
+class DateAxis:
     """
-    计算本金累计曲线
-    :param investment_dates: 投资日期列表
-    :param initial_investment: 初始投资金额
-    :param monthly_investment: 每月定投金额
-    :param date_range: 完整的日期范围
-    :return: 本金累计曲线字典
+    回测使用的日期轴，多只股票的结果共享同一个实例
+    日期字符串只在序列化时生成一次
     """
-    principal_curve = {}
-    
-    for date in date_range:
-        # 计算到该日期为止应该投入的总金额（纯本金）
-        investments_up_to_date = [d for d in investment_dates if d <= date]
-        if not investments_up_to_date:
-            invested_so_far = 0
-        else:
-            invested_so_far = initial_investment + (len(investments_up_to_date) - 1) * monthly_investment
-        
-        # 基准线就是投入的本金总额，不产生任何收益
-        principal_curve[date.strftime('%Y-%m-%d')] = invested_so_far
-    
-    return principal_curve
+    __slots__ = ('index', '_labels')
+
+    def __init__(self, index: pd.DatetimeIndex):
+        self.index = index
+        self._labels = None
+
+    def __len__(self) -> int:
+        return len(self.index)
+
+    def labels(self) -> List[str]:
+        """YYYY-MM-DD 格式的日期字符串列表"""
+        if self._labels is None:
+            self._labels = self.index.strftime('%Y-%m-%d').tolist()
+        return self._labels
+
+class BacktestResult:
+    """
+    单只股票的定投回测结果
+    每日数据以 NumPy 数组保存，只在 API 边界调用 to_dict() 时才转换为 JSON 字典
+    """
+    __slots__ = (
+        'axis', 'equity', 'invested', 'investment_positions',
+        'initial_investment', 'monthly_investment', 'metrics'
+    )
+
+    def __init__(
+        self,
+        axis: DateAxis,
+        equity: np.ndarray,
+        invested: np.ndarray,
+        investment_positions: np.ndarray,
+        initial_investment: float,
+        monthly_investment: float,
+        metrics: Dict[str, Any]
+    ):
+        self.axis = axis
+        self.equity = equity
+        self.invested = invested
+        self.investment_positions = investment_positions
+        self.initial_investment = initial_investment
+        self.monthly_investment = monthly_investment
+        self.metrics = metrics
+
+    @property
+    def trading_days(self) -> int:
+        return len(self.axis)
+
+    def summary(self) -> Dict[str, Any]:
+        """标量指标（不含每日曲线）"""
+        final_total = float(self.equity[-1])
+        total_invested = float(self.invested[-1])
+
+        # 计算收益率（相对于总投入）
+        total_return = (final_total / total_invested - 1) * 100 if total_invested > 0 else 0
+
+        return {
+            "initial_investment": self.initial_investment,
+            "monthly_investment": self.monthly_investment,
+            "total_invested": total_invested,
+            "final_total": final_total,
+            "total_return_pct": float(total_return),
+            "max_drawdown_pct": self.metrics['max_drawdown_pct'],
+            "xirr_pct": self.metrics['xirr_pct'],  # 资金加权年化收益率
+            "annualized_return_pct": self.metrics['annualized_return_pct'],  # 时间加权年化收益率
+            "annualized_volatility_pct": self.metrics['annualized_volatility_pct'],
+            "sharpe_ratio": self.metrics['sharpe_ratio'],
+            "sortino_ratio": self.metrics['sortino_ratio'],
+            "longest_drawdown_days": self.metrics['longest_drawdown_days'],  # 最长水下时间（自然日）
+            "max_drawdown_recovery_days": self.metrics['max_drawdown_recovery_days'],  # 最大回撤恢复天数，未恢复为 None
+            "benchmark_return_pct": 0.0,  # 本金基准收益率固定为0%
+            "absolute_profit": final_total - total_invested,  # 绝对收益金额
+            "total_investments": int(len(self.investment_positions)),
+        }
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为 API 返回的 JSON 字典"""
+        labels = self.axis.labels()
+        result = self.summary()
+        result["equity_curve"] = dict(zip(labels, self.equity.tolist()))
+        # 基准曲线就是累计投入的本金，没有任何收益
+        result["benchmark_curve"] = dict(zip(labels, self.invested.tolist()))
+        result["strategy_stats"] = {
+            "investment_dates": [labels[i] for i in self.investment_positions],
+            "trading_days": self.trading_days,
+            "investment_period_months": len(self.investment_positions) - 1
+        }
+        return result
+
+def _close_values(data: pd.DataFrame) -> np.ndarray:
+    """取出收盘价数组（兼容 yfinance 的多层列索引）"""
+    close = data['Close']
+    if isinstance(close, pd.DataFrame):
+        close = close.iloc[:, 0]
+    return close.to_numpy(dtype=np.float64)
+
+def _investment_positions(index: pd.DatetimeIndex) -> np.ndarray:
+    """定投日期在日期轴上的位置"""
+    investment_dates = calculate_investment_dates(index[0], index[-1], index)
+    return index.get_indexer(pd.DatetimeIndex(investment_dates))
+
+def _contributions(length: int, investment_positions: np.ndarray, initial_investment: float, monthly_investment: float) -> np.ndarray:
+    """每日投入金额：第一个投资日为初始投资，其余投资日为定投金额"""
+    contributions = np.zeros(length)
+    contributions[investment_positions] = monthly_investment
+    contributions[investment_positions[0]] = initial_investment
+    return contributions
+
+def _simulate(
+    close: np.ndarray,
+    investment_positions: np.ndarray,
+    initial_investment: float,
+    monthly_investment: float
+):
+    """
+    向量化模拟定投过程
+    :return: (每日资产净值, 每日累计投入)
+    """
+    contributions = _contributions(len(close), investment_positions, initial_investment, monthly_investment)
+
+    # 投资日按当日收盘价买入，定投策略不持有现金
+    shares_bought = np.zeros(len(close))
+    shares_bought[investment_positions] = contributions[investment_positions] / close[investment_positions]
+
+    equity = np.cumsum(shares_bought) * close
+    invested = np.cumsum(contributions)
+    return equity, invested
+
+def _backtest_on_axis(
+    axis: DateAxis,
+    close: np.ndarray,
+    investment_positions: np.ndarray,
+    initial_investment: float,
+    monthly_investment: float
+) -> BacktestResult:
+    """在给定日期轴和定投日期上执行回测"""
+    if len(close) < 30:  # 至少需要30天数据
+        raise ValueError(f"数据长度不足，至少需要30个数据点")
+
+    equity, invested = _simulate(close, investment_positions, initial_investment, monthly_investment)
+
+    # 一次计算最大回撤（相对于历史最高收益率）、XIRR、波动率、Sharpe/Sortino 和水下时间
+    metrics = compute_metrics(axis.index, equity, invested)
+
+    return BacktestResult(axis, equity, invested, investment_positions, initial_investment, monthly_investment, metrics)
 
 def run_backtest(
     data: pd.DataFrame, 
     initial_investment: float, 
     monthly_investment: float
-):
+) -> BacktestResult:
     """
     执行定投策略回测
     :param data: 包含股价数据的 DataFrame，必须包含 'Close' 列
     :param initial_investment: 初始投资金额
     :param monthly_investment: 每月定投金额
-    :return: 包含性能指标和每日资产净值的字典
+    :return: 回测结果，调用 to_dict() 得到性能指标和每日资产净值
     """
     
     # 检查数据有效性
     if data.empty:
         raise ValueError("数据为空")
     
-    if 'Close' not in data.columns:
+    if 'Close' not in data.columns.get_level_values(0):
         raise ValueError("数据必须包含 'Close' 列")
     
     if len(data) < 30:  # 至少需要30天数据
         raise ValueError(f"数据长度不足，至少需要30个数据点")
     
-    # 1. 准备数据
-    df = data.copy()
-    
-    # 处理多层索引列的情况
-    if isinstance(df.columns, pd.MultiIndex):
-        df.columns = df.columns.get_level_values(0)
-    
-    # 确保索引是日期类型
-    if not isinstance(df.index, pd.DatetimeIndex):
-        df.index = pd.to_datetime(df.index)
-    
-    # 2. 计算定投日期（每月第一个交易日）
-    investment_dates = calculate_investment_dates(df.index[0], df.index[-1], df.index)
-    
-    # 3. 模拟定投过程
-    portfolio = pd.DataFrame(index=df.index)
-    portfolio['cash'] = 0.0
-    portfolio['shares'] = 0.0
-    portfolio['total_invested'] = 0.0  # 累计投入金额
-    portfolio['holdings'] = 0.0
-    portfolio['total'] = 0.0
-    
-    # 初始化
-    current_shares = 0.0
-    total_invested = 0.0
-    
-    # 遍历每一天
-    for i, date in enumerate(df.index):
-        current_price = df.loc[date, 'Close']
-        
-        # 检查是否为投资日
-        if date in investment_dates:
-            if date == investment_dates[0]:
-                # 初始投资
-                investment_amount = initial_investment
-            else:
-                # 定期投资
-                investment_amount = monthly_investment
-            
-            # 计算可购买的股数
-            shares_to_buy = investment_amount / current_price
-            current_shares += shares_to_buy
-            total_invested += investment_amount
-        
-        # 更新每日资产状态
-        portfolio.loc[date, 'shares'] = current_shares
-        portfolio.loc[date, 'total_invested'] = total_invested
-        portfolio.loc[date, 'holdings'] = current_shares * current_price
-        portfolio.loc[date, 'total'] = portfolio.loc[date, 'holdings']
-        portfolio.loc[date, 'cash'] = 0.0  # 定投策略不持有现金
-    
-    # 4. 计算性能指标
-    final_total = portfolio['total'].iloc[-1]
-    total_invested_final = portfolio['total_invested'].iloc[-1]
-    
-    # 计算收益率（相对于总投入）
-    total_return = (final_total / total_invested_final - 1) * 100 if total_invested_final > 0 else 0
-    
-    # 计算最大回撤（相对于当时累计投入）
-    portfolio['return_pct'] = (portfolio['total'] / portfolio['total_invested'] - 1) * 100
-    portfolio['return_pct'].fillna(0, inplace=True)
-    
-    # 计算回撤（相对于历史最高收益率）
-    running_max_return = portfolio['return_pct'].cummax()
-    drawdown = portfolio['return_pct'] - running_max_return
-    max_drawdown = drawdown.min()
-    
-    # 计算基准收益（投入本金，无任何投资收益）
-    # 基准就是累计投入的本金总额，没有任何收益
-    benchmark_return = 0  # 本金基准收益率为0%
+    # 确保索引是日期类型（只转换索引，不复制数据）
+    index = data.index
+    if not isinstance(index, pd.DatetimeIndex):
+        index = pd.to_datetime(index)
     
-    # 统计投资次数
-    total_investments = len(investment_dates)
+    axis = DateAxis(index)
     
-    # 构建基准曲线（纯本金累计，无投资收益）
-    benchmark_curve = calculate_principal_line(investment_dates, initial_investment, monthly_investment, df.index)
+    # 计算定投日期（每月第一个交易日）
+    investment_positions = _investment_positions(index)
     
-    # 转换日期格式用于JSON序列化
-    portfolio_dict = portfolio.copy()
-    portfolio_dict.index = portfolio_dict.index.strftime('%Y-%m-%d')
-    
-    return {
-        "initial_investment": initial_investment,
-        "monthly_investment": monthly_investment,
-        "total_invested": float(total_invested_final),
-        "final_total": float(final_total),
-        "total_return_pct": float(total_return),
-        "max_drawdown_pct": float(max_drawdown),
-        "benchmark_return_pct": float(benchmark_return),  # 本金基准收益率固定为0%
-        "absolute_profit": float(final_total - total_invested_final),  # 绝对收益金额
-        "total_investments": int(total_investments),
-        "equity_curve": portfolio_dict['total'].to_dict(),
-        "benchmark_curve": benchmark_curve,
-        "strategy_stats": {
-            "investment_dates": [d.strftime('%Y-%m-%d') for d in investment_dates],
-            "trading_days": len(df),
-            "investment_period_months": len(investment_dates) - 1
+    return _backtest_on_axis(axis, _close_values(data), investment_positions, initial_investment, monthly_investment)
+
+def run_backtest_on_column(
+    dates: pd.DatetimeIndex,
+    close: np.ndarray,
+    initial_investment: float,
+    monthly_investment: float
+) -> BacktestResult:
+    """
+    直接对价格列执行定投回测（如 UniversePrices.column() 返回的内存映射视图），不构造 DataFrame
+    :param dates: 与 close 一一对应的日期
+    :param close: 收盘价数组，NaN 表示当天无交易（节假日、停牌、未上市），这些行会被跳过
+    :param initial_investment: 初始投资金额
+    :param monthly_investment: 每月定投金额
+    :return: 回测结果，日期轴只包含有交易的日期
+    """
+    close = np.asarray(close)
+    valid = np.isfinite(close)
+    if not valid.all():
+        dates = dates[valid]
+        close = close[valid]
+
+    if len(close) < 30:  # 至少需要30天数据
+        raise ValueError(f"数据长度不足，至少需要30个数据点")
+
+    # 有效行筛选和 float64 转换合计只复制一次
+    close = close.astype(np.float64, copy=False)
+    index = pd.DatetimeIndex(dates)
+    investment_positions = _investment_positions(index)
+
+    return _backtest_on_axis(DateAxis(index), close, investment_positions, initial_investment, monthly_investment)
+
+class MultipleBacktestResult:
+    """多只股票的对比回测结果，所有股票共享同一个日期轴和本金曲线"""
+    __slots__ = (
+        'axis', 'principal', 'investment_positions',
+        'initial_investment', 'monthly_investment', 'results'
+    )
+
+    def __init__(
+        self,
+        axis: DateAxis,
+        principal: np.ndarray,
+        investment_positions: np.ndarray,
+        initial_investment: float,
+        monthly_investment: float,
+        results: List[Dict[str, Any]]
+    ):
+        self.axis = axis
+        self.principal = principal
+        self.investment_positions = investment_positions
+        self.initial_investment = initial_investment
+        self.monthly_investment = monthly_investment
+        self.results = results
+
+    def to_dict(self) -> Dict[str, Any]:
+        """转换为 API 返回的 JSON 字典"""
+        results = []
+        for item in self.results:
+            if item['success']:
+                item = dict(item, result=item['result'].to_dict())
+            results.append(item)
+
+        return {
+            "principal_data": {
+                "curve": dict(zip(self.axis.labels(), self.principal.tolist())),
+                "initial_investment": self.initial_investment,
+                "monthly_investment": self.monthly_investment,
+                "total_investments": len(self.investment_positions)
+            },
+            "results": results,
+            "common_dates": {
+                "start": self.axis.labels()[0],
+                "end": self.axis.labels()[-1],
+                "total_days": len(self.axis)
+            }
         }
-    }
 
 def backtest_multiple(
     stocks_data: List[Dict[str, Any]], 
     initial_investment: float, 
     monthly_investment: float,
     max_workers: int = 5
-) -> Dict[str, Any]:
+) -> MultipleBacktestResult:
     """
     批量执行多个股票的定投策略回测
     :param stocks_data: 股票数据列表，每个元素包含 'name', 'code', 'data' (DataFrame)
     :param initial_investment: 初始投资金额
     :param monthly_investment: 每月定投金额
     :param max_workers: 最大并行工作线程数
-    :return: 包含所有股票回测结果的字典
+    :return: 包含所有股票回测结果的对象，调用 to_dict() 得到 JSON 字典
     """
     
     if not stocks_data:
@@ -209,34 +321,35 @@ def backtest_multiple(
         raise ValueError("最多支持5个股票同时对比")
     
     # 找出所有股票的共同日期范围
-    all_dates = []
+    common_date_index = None
     for stock in stocks_data:
         if 'data' not in stock or stock['data'].empty:
             raise ValueError(f"股票 {stock.get('code', 'unknown')} 数据为空")
-        all_dates.append(set(stock['data'].index))
+        index = pd.DatetimeIndex(stock['data'].index)
+        common_date_index = index if common_date_index is None else common_date_index.intersection(index)
     
     # 获取共同交易日
-    common_dates = set.intersection(*all_dates) if all_dates else set()
-    if not common_dates:
+    if common_date_index is None or len(common_date_index) == 0:
         raise ValueError("所选股票没有共同的交易日期")
     
-    common_dates = sorted(list(common_dates))
-    common_date_index = pd.DatetimeIndex(common_dates)
+    common_date_index = common_date_index.sort_values()
+    axis = DateAxis(common_date_index)
     
     # 计算共同的投资日期
-    investment_dates = calculate_investment_dates(common_date_index[0], common_date_index[-1], common_date_index)
+    investment_positions = _investment_positions(common_date_index)
     
     # 计算共享的本金曲线
-    principal_curve = calculate_principal_line(investment_dates, initial_investment, monthly_investment, common_date_index)
+    principal = np.cumsum(_contributions(len(common_date_index), investment_positions, initial_investment, monthly_investment))
     
     # 定义单个股票回测任务
     def backtest_single(stock_info: Dict[str, Any]) -> Dict[str, Any]:
         try:
-            # 只使用共同日期的数据
-            stock_data = stock_info['data'].loc[common_date_index]
+            # 只取共同日期上的收盘价
+            data = stock_info['data']
+            close = _close_values(data)[pd.DatetimeIndex(data.index).get_indexer(common_date_index)]
             
             # 执行回测
-            result = run_backtest(stock_data, initial_investment, monthly_investment)
+            result = _backtest_on_axis(axis, close, investment_positions, initial_investment, monthly_investment)
             
             return {
                 "success": True,
@@ -264,18 +377,4 @@ def backtest_multiple(
     # 按原始顺序排序结果
     results.sort(key=lambda x: next(i for i, s in enumerate(stocks_data) if s['code'] == x['stock_code']))
     
-    # 构建返回结果
-    return {
-        "principal_data": {
-            "curve": principal_curve,
-            "initial_investment": initial_investment,
-            "monthly_investment": monthly_investment,
-            "total_investments": len(investment_dates)
-        },
-        "results": results,
-        "common_dates": {
-            "start": common_date_index[0].strftime('%Y-%m-%d'),
-            "end": common_date_index[-1].strftime('%Y-%m-%d'),
-            "total_days": len(common_date_index)
-        }
-    }
\ No newline at end of file
+    return MultipleBacktestResult(axis, principal, investment_positions, initial_investment, monthly_investment, results)
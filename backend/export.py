@@ -0,0 +1,141 @@
+# backend/export.py
+import io
+import json
+import numpy as np
+import pandas as pd
+from typing import Iterator, List, Tuple
+
+# Arrow 为可选依赖，未安装 pyarrow 时只提供 CSV / NDJSON
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+# 支持的流式导出格式及对应的 Content-Type
+EXPORT_FORMATS = {
+    'csv': 'text/csv',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+}
+
+# 每次写出的行数，保证内存占用与区间长度无关
+DEFAULT_CHUNK_SIZE = 5000
+
+def check_export_format(fmt: str) -> None:
+    """
+    检查导出格式是否可用
+    :param fmt: 格式名称
+    """
+    if fmt not in EXPORT_FORMATS:
+        raise ValueError(f"不支持的导出格式: {fmt}，可选: json, {', '.join(EXPORT_FORMATS)}")
+    if fmt == 'arrow' and pa is None:
+        raise ValueError("Arrow 格式需要安装 pyarrow")
+
+def _prepare_columns(data: pd.DataFrame) -> Tuple[np.ndarray, List[str], List[np.ndarray]]:
+    """
+    取出日期和各列的底层数组，不构造逐行对象
+    :param data: 以日期为索引的行情 DataFrame
+    :return: (datetime64 日期数组, 列名列表, 列数组列表)
+    """
+    index = data.index
+    if not isinstance(index, pd.DatetimeIndex):
+        index = pd.to_datetime(index)
+    if index.tz is not None:
+        # Ticker.history 返回带时区的索引，按交易所当地日期输出
+        index = index.tz_localize(None)
+
+    names = [str(c) for c in data.columns]
+    arrays = [data[c].to_numpy() for c in data.columns]
+    return index.values, names, arrays
+
+def _format_dates(dates: np.ndarray) -> np.ndarray:
+    """将一段 datetime64 数组格式化为 YYYY-MM-DD 字符串数组"""
+    return np.datetime_as_string(dates, unit='D')
+
+def _format_values(values: np.ndarray, null: str) -> np.ndarray:
+    """
+    将一段数值数组格式化为字符串数组，缺失值和非有限值替换为 null
+    :param values: 数值数组
+    :param null: 缺失值的输出文本
+    """
+    text = values.astype(str)
+    if values.dtype.kind == 'f':
+        missing = ~np.isfinite(values)
+        if missing.any():
+            text[missing] = null
+    return text
+
+def iter_csv(data: pd.DataFrame, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    按块输出 CSV
+    :param data: 以日期为索引的行情 DataFrame
+    :param chunk_size: 每块行数
+    """
+    dates, names, arrays = _prepare_columns(data)
+    yield (','.join(['Date'] + names) + '\n').encode('utf-8')
+
+    for start in range(0, len(dates), chunk_size):
+        stop = start + chunk_size
+        columns = [_format_dates(dates[start:stop])] + [_format_values(a[start:stop], '') for a in arrays]
+        yield ('\n'.join(map(','.join, zip(*columns))) + '\n').encode('utf-8')
+
+def iter_ndjson(data: pd.DataFrame, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    按块输出 NDJSON（每行一个 JSON 对象）
+    :param data: 以日期为索引的行情 DataFrame
+    :param chunk_size: 每块行数
+    """
+    dates, names, arrays = _prepare_columns(data)
+    template = '{' + ','.join(f'{json.dumps(n, ensure_ascii=False)}:%s' for n in ['Date'] + names) + '}'
+
+    for start in range(0, len(dates), chunk_size):
+        stop = start + chunk_size
+        quoted_dates = np.char.add(np.char.add('"', _format_dates(dates[start:stop])), '"')
+        columns = [quoted_dates] + [_format_values(a[start:stop], 'null') for a in arrays]
+        yield ('\n'.join(template % row for row in zip(*columns)) + '\n').encode('utf-8')
+
+def _drain(sink: io.BytesIO) -> bytes:
+    """取出缓冲区中已写入的字节并清空缓冲区"""
+    chunk = sink.getvalue()
+    sink.seek(0)
+    sink.truncate()
+    return chunk
+
+def iter_arrow(data: pd.DataFrame, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    按块输出 Arrow IPC 流，每块一个 RecordBatch
+    :param data: 以日期为索引的行情 DataFrame
+    :param chunk_size: 每块行数
+    """
+    dates, names, arrays = _prepare_columns(data)
+    schema = pa.schema(
+        [('Date', pa.timestamp('ns'))] +
+        [(n, pa.from_numpy_dtype(a.dtype)) for n, a in zip(names, arrays)]
+    )
+
+    sink = io.BytesIO()
+    with pa.ipc.new_stream(sink, schema) as writer:
+        yield _drain(sink)
+        for start in range(0, len(dates), chunk_size):
+            stop = start + chunk_size
+            columns = [pa.array(dates[start:stop], type=pa.timestamp('ns'))]
+            columns += [pa.array(a[start:stop], from_pandas=True) for a in arrays]
+            writer.write_batch(pa.record_batch(columns, schema=schema))
+            yield _drain(sink)
+    yield _drain(sink)
+
+def stream_export(data: pd.DataFrame, fmt: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[bytes]:
+    """
+    按指定格式流式导出行情数据
+    :param data: 以日期为索引的行情 DataFrame
+    :param fmt: 导出格式（csv / ndjson / arrow）
+    :param chunk_size: 每块行数
+    :return: 字节块迭代器
+    """
+    check_export_format(fmt)
+
+    if fmt == 'csv':
+        return iter_csv(data, chunk_size)
+    if fmt == 'ndjson':
+        return iter_ndjson(data, chunk_size)
+    return iter_arrow(data, chunk_size)
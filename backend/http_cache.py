@@ -0,0 +1,91 @@
+# backend/http_cache.py
+import os
+import json
+import hashlib
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Optional
+import pandas as pd
+from fastapi import Response
+
+# 数据版本号：回测引擎或输出格式变化时需手动修改该值，使所有旧的 ETag 失效
+# （行情数据本身的变化由 data_fingerprint 反映在 ETag 中，无需修改）
+DATA_VERSION = os.getenv('DATA_VERSION', '1')
+
+# 历史区间结果的缓存时长（秒）
+# 复权价格可能因后续分红/拆股而被修正，所以不使用 immutable，而是到期后用 ETag 重新验证：
+# ETag 包含行情数据指纹，服务端行情缓存过期重新下载后，数据若有修正 ETag 随之变化
+HISTORICAL_MAX_AGE = int(os.getenv('HISTORICAL_MAX_AGE', '86400'))
+
+# 结束日期距今至少这么多天才视为"历史区间"，留出时区和数据延迟的余量
+HISTORICAL_LAG_DAYS = 2
+
+def is_historical_range(end_date: str) -> bool:
+    """
+    判断时间区间是否已经完全落在过去（结果不会再随新行情变化）
+    :param end_date: 结束日期，格式 YYYY-MM-DD
+    :return: 是否为历史区间
+    """
+    try:
+        end = datetime.strptime(end_date[:10], '%Y-%m-%d').date()
+    except (TypeError, ValueError):
+        return False
+
+    today = datetime.now(timezone.utc).date()
+    return end <= today - timedelta(days=HISTORICAL_LAG_DAYS)
+
+def data_fingerprint(data: pd.DataFrame) -> str:
+    """
+    计算行情数据的指纹（索引和所有列的值），数据被修正时指纹随之变化
+    :param data: 行情 DataFrame
+    :return: 十六进制指纹字符串
+    """
+    hashed = pd.util.hash_pandas_object(data, index=True).to_numpy()
+    return hashlib.sha256(hashed.tobytes()).hexdigest()[:32]
+
+def make_etag(*parts: Any) -> str:
+    """
+    根据请求参数、行情数据指纹和数据版本生成弱 ETag
+    使用弱 ETag 是因为同一内容会以不同的压缩编码（identity / gzip / br）发送
+    :param parts: 决定响应内容的参数（类型、ticker、日期范围、回测参数、数据指纹等）
+    :return: 形如 W/"..." 的 ETag 字符串
+    """
+    payload = json.dumps([DATA_VERSION, *parts], ensure_ascii=False, separators=(',', ':'), default=str)
+    return 'W/"' + hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32] + '"'
+
+def _opaque_tag(etag: str) -> str:
+    """去掉弱标记 W/，用于弱比较"""
+    etag = etag.strip()
+    return etag[2:] if etag.startswith('W/') else etag
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    检查 If-None-Match 请求头是否命中 ETag（If-None-Match 使用弱比较）
+    :param if_none_match: 请求头原始值
+    :param etag: 当前响应的 ETag
+    :return: 是否命中
+    """
+    if not if_none_match:
+        return False
+
+    if if_none_match.strip() == '*':
+        return True
+
+    target = _opaque_tag(etag)
+    return any(_opaque_tag(candidate) == target for candidate in if_none_match.split(','))
+
+def cache_headers(etag: Optional[str]) -> Dict[str, str]:
+    """
+    生成缓存相关响应头
+    :param etag: ETag，为 None 表示结果不确定（区间包含最新行情），不允许复用
+    :return: 响应头字典
+    """
+    if etag is None:
+        return {'Cache-Control': 'no-cache'}
+    return {
+        'ETag': etag,
+        'Cache-Control': f'public, max-age={HISTORICAL_MAX_AGE}',
+    }
+
+def not_modified(etag: str) -> Response:
+    """返回 304 Not Modified 响应"""
+    return Response(status_code=304, headers=cache_headers(etag))
@@ -1,14 +1,20 @@
 # backend/main.py
 
-from fastapi import FastAPI, HTTPException, Query, Request
+from fastapi import FastAPI, HTTPException, Query, Request, Response, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.responses import StreamingResponse
 from fastapi.staticfiles import StaticFiles
 from pydantic import BaseModel
+from typing import List, Optional
 import os
 import pandas as pd
 import psycopg2
 from psycopg2.extras import RealDictCursor
 from engine import run_backtest, backtest_multiple
+from export import EXPORT_FORMATS, check_export_format, stream_export
+from http_cache import is_historical_range, data_fingerprint, make_etag, etag_matches, cache_headers, not_modified
+from cache import get_cache, make_key
 
 # 解决yfinance缓存目录问题
 def setup_yfinance():
@@ -43,8 +49,19 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST", "PUT", "DELETE", "OPTIONS"],
     allow_headers=["*"],
+    expose_headers=["ETag"],
 )
 
+# --- 配置响应压缩中间件 ---
+# 小于阈值的响应不压缩；优先使用 brotli，未安装 brotli-asgi 时回退到 gzip
+COMPRESSION_MIN_SIZE = int(os.getenv('COMPRESSION_MIN_SIZE', '1024'))
+
+try:
+    from brotli_asgi import BrotliMiddleware
+    app.add_middleware(BrotliMiddleware, minimum_size=COMPRESSION_MIN_SIZE, gzip_fallback=True)
+except ImportError:
+    app.add_middleware(GZipMiddleware, minimum_size=COMPRESSION_MIN_SIZE)
+
 # 请求调试中间件
 @app.middleware("http")
 async def debug_requests(request: Request, call_next):
@@ -83,6 +100,99 @@ def convert_to_yfinance_ticker(stock_code: str, market: str) -> str:
     else:
         return stock_code
 
+# --- 共享缓存 ---
+# 同一主机的多个 worker 共用行情数据和回测结果，避免重复请求 Yahoo Finance
+cache = get_cache()
+
+# 历史区间的数据基本不变，缓存一天；包含最新行情的区间只缓存很短时间
+HISTORICAL_CACHE_TTL = 86400
+RECENT_CACHE_TTL = 900
+
+def cache_ttl(end_date: str) -> int:
+    """根据结束日期决定缓存时长"""
+    return HISTORICAL_CACHE_TTL if is_historical_range(end_date) else RECENT_CACHE_TTL
+
+def fetch_price_data(ticker: str, start_date: str, end_date: str, allow_period_fallback: bool = False) -> pd.DataFrame:
+    """
+    获取行情数据：优先读取共享缓存，未命中时按多重方法下载并写入缓存
+    :param ticker: yfinance 格式的代码
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param allow_period_fallback: 前两种方法失败时，是否尝试先验证代码再按最近一年下载
+    :return: 行情 DataFrame（单层列索引），获取失败时为空；来自缓存时应视为只读
+    方法3只下载最近一年的数据，不完整，因此不写入缓存，避免之后的请求（包括批量回测）拿到截断的数据
+    """
+    key = make_key('prices', ticker, start_date, end_date)
+    data = cache.get(key)
+    if data is not None:
+        print(f"缓存命中: {ticker} {start_date} ~ {end_date}")
+        return data
+    
+    print(f"开始下载 {ticker} 的数据...")
+    data = pd.DataFrame()
+    used_period_fallback = False
+    
+    # 方法1: 标准yf.download
+    try:
+        data = yf.download(
+            ticker, 
+            start=start_date, 
+            end=end_date, 
+            auto_adjust=True,
+            progress=False,
+            threads=False  # 避免多线程问题
+        )
+        print(f"方法1完成，数据行数: {len(data)}")
+    except Exception as e:
+        print(f"方法1失败 ({ticker}): {e}")
+    
+    # 方法2: 使用Ticker对象 (如果方法1失败)
+    if data.empty:
+        try:
+            print("尝试使用Ticker对象...")
+            ticker_obj = yf.Ticker(ticker)
+            data = ticker_obj.history(
+                start=start_date,
+                end=end_date,
+                auto_adjust=True,
+                timeout=30
+            )
+            print(f"方法2完成，数据行数: {len(data)}")
+        except Exception as e:
+            print(f"方法2失败 ({ticker}): {e}")
+    
+    # 方法3: 单独获取info然后历史数据 (如果前两种都失败)
+    if data.empty and allow_period_fallback:
+        try:
+            print("尝试分步获取数据...")
+            ticker_obj = yf.Ticker(ticker)
+            # 先获取基本信息验证ticker有效性
+            info = ticker_obj.info
+            if info and 'symbol' in info:
+                data = ticker_obj.history(
+                    period="1y",  # 改用period而不是日期范围
+                    auto_adjust=True
+                )
+                # 过滤到指定日期范围
+                if not data.empty:
+                    data = data.loc[start_date:end_date]
+                    used_period_fallback = True
+            print(f"方法3完成，数据行数: {len(data)}")
+        except Exception as e:
+            print(f"方法3失败 ({ticker}): {e}")
+    
+    if data.empty:
+        return data
+    
+    # 处理多层列索引问题
+    if isinstance(data.columns, pd.MultiIndex):
+        # 展平列索引，只保留第一层（Open, High, Low, Close, Volume）
+        data.columns = data.columns.get_level_values(0)
+    
+    if not used_period_fallback:
+        cache.set(key, data, ttl=cache_ttl(end_date))
+    return data
+
 # --- API 端点 (Endpoints) ---
 
 @app.get("/")
@@ -161,26 +271,50 @@ def search_stocks(q: str = Query(..., min_length=1, description="搜索词，可
         ]
 
 @app.get("/api/data/{market}/{stock_code}")
-def get_stock_data(market: str, stock_code: str, start_date: str, end_date: str):
+def get_stock_data(
+    market: str, 
+    stock_code: str, 
+    start_date: str, 
+    end_date: str, 
+    http_request: Request, 
+    response: Response,
+    fmt: str = Query('json', alias='format', description="输出格式：json / csv / ndjson / arrow")
+):
     """获取指定股票在特定时间范围内的历史数据"""
     ticker = convert_to_yfinance_ticker(stock_code, market)
     
+    # 非 JSON 格式以流式输出，先校验格式再下载数据
+    fmt = fmt.lower()
+    if fmt != 'json':
+        try:
+            check_export_format(fmt)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    
     try:
-        # 下载数据，yfinance 会自动处理日期格式
-        data = yf.download(ticker, start=start_date, end=end_date, auto_adjust=True)
+        # 获取数据（优先读取共享缓存），yfinance 会自动处理日期格式
+        data = fetch_price_data(ticker, start_date, end_date)
         
         if data.empty:
             raise HTTPException(status_code=404, detail="无法获取该股票或该时间段的数据")
-
-        # 处理多层列索引问题
-        if isinstance(data.columns, pd.MultiIndex):
-            # 展平列索引，只保留第一层（Open, High, Low, Close, Volume）
-            data.columns = data.columns.get_level_values(0)
+        
+        # 历史区间的数据是确定的，客户端已有相同版本时直接返回 304
+        etag = None
+        if is_historical_range(end_date):
+            etag = make_etag('data', ticker, start_date, end_date, fmt, data_fingerprint(data))
+            if etag_matches(http_request.headers.get('if-none-match'), etag):
+                return not_modified(etag)
+        
+        # 流式格式：直接从列数组按块写出，不构造逐行字典
+        if fmt != 'json':
+            headers = cache_headers(etag)
+            headers['Content-Disposition'] = f'attachment; filename="{ticker}_{start_date}_{end_date}.{fmt}"'
+            return StreamingResponse(stream_export(data, fmt), media_type=EXPORT_FORMATS[fmt], headers=headers)
         
         # 将 DataFrame 转换为 JSON 格式返回
-        # 重置索引，让日期成为一列，方便前端处理
-        data.reset_index(inplace=True)
-        return data.to_dict('records')
+        # 重置索引，让日期成为一列，方便前端处理（不修改缓存中的对象）
+        response.headers.update(cache_headers(etag))
+        return data.reset_index().to_dict('records')
 
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"获取数据时发生错误: {str(e)}")
@@ -210,80 +344,51 @@ async def backtest_options():
     """处理CORS预检请求"""
     return {"message": "OK"}
 
-@app.post("/api/backtest")
-async def do_backtest(request: BacktestRequest):
-    """执行回测并返回结果"""
+def handle_backtest(request: BacktestRequest, response: Response, http_request: Optional[Request] = None):
+    """
+    执行回测并返回结果
+    :param http_request: GET 请求对象；为 None 时（POST 请求不可缓存）不生成 ETag、不设置缓存响应头
+    """
     print(f"收到回测请求: {request}")  # 调试日志
     
     ticker = convert_to_yfinance_ticker(request.stock_code, request.market)
     print(f"转换后的ticker: {ticker}")  # 调试日志
     
     try:
-        # 1. 获取数据 - 多重方法和重试机制
-        print(f"开始下载 {ticker} 的数据...")
-        data = pd.DataFrame()
-        
-        # 方法1: 标准yf.download
-        try:
-            data = yf.download(
-                ticker, 
-                start=request.start_date, 
-                end=request.end_date, 
-                auto_adjust=True,
-                progress=False,
-                threads=False  # 避免多线程问题
-            )
-            print(f"方法1完成，数据行数: {len(data)}")
-        except Exception as e:
-            print(f"方法1失败: {e}")
-        
-        # 方法2: 使用Ticker对象 (如果方法1失败)
-        if data.empty:
-            try:
-                print("尝试使用Ticker对象...")
-                ticker_obj = yf.Ticker(ticker)
-                data = ticker_obj.history(
-                    start=request.start_date,
-                    end=request.end_date,
-                    auto_adjust=True,
-                    timeout=30
-                )
-                print(f"方法2完成，数据行数: {len(data)}")
-            except Exception as e:
-                print(f"方法2失败: {e}")
-        
-        # 方法3: 单独获取info然后历史数据 (如果前两种都失败)
-        if data.empty:
-            try:
-                print("尝试分步获取数据...")
-                ticker_obj = yf.Ticker(ticker)
-                # 先获取基本信息验证ticker有效性
-                info = ticker_obj.info
-                if info and 'symbol' in info:
-                    data = ticker_obj.history(
-                        period="1y",  # 改用period而不是日期范围
-                        auto_adjust=True
-                    )
-                    # 过滤到指定日期范围
-                    if not data.empty:
-                        data = data.loc[request.start_date:request.end_date]
-                print(f"方法3完成，数据行数: {len(data)}")
-            except Exception as e:
-                print(f"方法3失败: {e}")
+        # 1. 获取数据 - 共享缓存 + 多重方法和重试机制
+        data = fetch_price_data(ticker, request.start_date, request.end_date, allow_period_fallback=True)
         
         if data.empty:
             raise HTTPException(
                 status_code=404, 
                 detail=f"无法获取 {ticker} 的数据。可能原因：1)股票代码不存在 2)日期范围无效 3)Yahoo Finance服务暂时不可用"
             )
-
-        # 2. 运行回测引擎
-        print("开始运行回测引擎...")
-        results = run_backtest(data, request.initial_investment, request.monthly_investment)
-        print("回测完成")
         
-        # 3. 返回结果
-        return results
+        # 历史区间的回测结果由参数和行情数据唯一确定，命中 ETag 时无需重新计算
+        fingerprint = data_fingerprint(data)
+        etag = None
+        if http_request is not None and is_historical_range(request.end_date):
+            etag = make_etag('backtest', ticker, request.start_date, request.end_date,
+                             request.initial_investment, request.monthly_investment, fingerprint)
+            if etag_matches(http_request.headers.get('if-none-match'), etag):
+                return not_modified(etag)
+
+        # 2. 运行回测引擎（相同参数和数据的结果可能已由其他 worker 计算过）
+        result_key = make_key('backtest', ticker, request.start_date, request.end_date,
+                              request.initial_investment, request.monthly_investment, fingerprint)
+        results = cache.get(result_key)
+        if results is not None:
+            print("回测结果缓存命中")
+        else:
+            print("开始运行回测引擎...")
+            results = run_backtest(data, request.initial_investment, request.monthly_investment)
+            print("回测完成")
+            cache.set(result_key, results, ttl=cache_ttl(request.end_date))
+        
+        # 3. 返回结果（只在这里序列化为 JSON 字典）
+        if http_request is not None:
+            response.headers.update(cache_headers(etag))
+        return results.to_dict()
 
     except ValueError as e:
         error_msg = f"数据验证错误: {str(e)}"
@@ -296,14 +401,26 @@ async def do_backtest(request: BacktestRequest):
         print(f"Exception: {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/api/backtest")
+async def do_backtest(request: BacktestRequest, response: Response):
+    """执行回测并返回结果"""
+    return handle_backtest(request, response)
+
+@app.get("/api/backtest")
+def do_backtest_get(http_request: Request, response: Response, request: BacktestRequest = Depends()):
+    """执行回测并返回结果（GET 版本，历史区间的结果可被浏览器/CDN 缓存，并支持 If-None-Match）"""
+    return handle_backtest(request, response, http_request)
+
 @app.options("/api/backtest-multiple")
 async def backtest_multiple_options():
     """处理CORS预检请求"""
     return {"message": "OK"}
 
-@app.post("/api/backtest-multiple")
-async def do_backtest_multiple(request: MultipleBacktestRequest):
-    """执行多个股票的批量回测并返回结果"""
+def handle_backtest_multiple(request: MultipleBacktestRequest, response: Response, http_request: Optional[Request] = None):
+    """
+    执行多个股票的批量回测并返回结果
+    :param http_request: GET 请求对象；为 None 时（POST 请求不可缓存）不生成 ETag、不设置缓存响应头
+    """
     print(f"收到批量回测请求: {len(request.stocks)} 个股票")
     
     # 验证股票数量
@@ -313,40 +430,15 @@ async def do_backtest_multiple(request: MultipleBacktestRequest):
         raise HTTPException(status_code=400, detail="最多支持5个股票同时对比")
     
     try:
-        # 收集每个股票的数据
+        # 收集每个股票的数据及其指纹
         stocks_data = []
+        stocks_key = []
         for stock in request.stocks:
             ticker = convert_to_yfinance_ticker(stock.stock_code, stock.market)
             print(f"获取 {stock.name} ({ticker}) 的数据...")
             
-            # 使用与单个回测相同的多重方法获取数据
-            data = pd.DataFrame()
-            
-            # 方法1: 标准yf.download
-            try:
-                data = yf.download(
-                    ticker, 
-                    start=request.start_date, 
-                    end=request.end_date, 
-                    auto_adjust=True,
-                    progress=False,
-                    threads=False
-                )
-            except Exception as e:
-                print(f"方法1失败 ({ticker}): {e}")
-            
-            # 方法2: 使用Ticker对象
-            if data.empty:
-                try:
-                    ticker_obj = yf.Ticker(ticker)
-                    data = ticker_obj.history(
-                        start=request.start_date,
-                        end=request.end_date,
-                        auto_adjust=True,
-                        timeout=30
-                    )
-                except Exception as e:
-                    print(f"方法2失败 ({ticker}): {e}")
+            # 使用与单个回测相同的缓存和多重方法获取数据
+            data = fetch_price_data(ticker, request.start_date, request.end_date)
             
             # 检查数据是否为空
             if data.empty:
@@ -358,6 +450,7 @@ async def do_backtest_multiple(request: MultipleBacktestRequest):
                 'name': stock.name,
                 'data': data
             })
+            stocks_key.append((ticker, stock.stock_code, stock.name, data_fingerprint(data)))
         
         if len(stocks_data) < 2:
             raise HTTPException(
@@ -365,16 +458,33 @@ async def do_backtest_multiple(request: MultipleBacktestRequest):
                 detail="无法获取足够的股票数据进行对比，请检查股票代码和日期范围"
             )
         
-        # 执行批量回测
-        print(f"开始批量回测 {len(stocks_data)} 个股票...")
-        results = backtest_multiple(
-            stocks_data, 
-            request.initial_investment, 
-            request.monthly_investment
-        )
-        print("批量回测完成")
+        # 历史区间的对比结果由参数和行情数据唯一确定，命中 ETag 时无需重新计算
+        etag = None
+        if http_request is not None and is_historical_range(request.end_date):
+            etag = make_etag('backtest-multiple', stocks_key, request.start_date, request.end_date,
+                             request.initial_investment, request.monthly_investment)
+            if etag_matches(http_request.headers.get('if-none-match'), etag):
+                return not_modified(etag)
+        
+        # 执行批量回测（相同参数和数据的结果可能已由其他 worker 计算过）
+        result_key = make_key('backtest-multiple', stocks_key, request.start_date, request.end_date,
+                              request.initial_investment, request.monthly_investment)
+        results = cache.get(result_key)
+        if results is not None:
+            print("批量回测结果缓存命中")
+        else:
+            print(f"开始批量回测 {len(stocks_data)} 个股票...")
+            results = backtest_multiple(
+                stocks_data, 
+                request.initial_investment, 
+                request.monthly_investment
+            )
+            print("批量回测完成")
+            cache.set(result_key, results, ttl=cache_ttl(request.end_date))
         
-        return results
+        if http_request is not None:
+            response.headers.update(cache_headers(etag))
+        return results.to_dict()
         
     except HTTPException as e:
         raise e
@@ -383,6 +493,38 @@ async def do_backtest_multiple(request: MultipleBacktestRequest):
         print(f"Exception: {error_msg}")
         raise HTTPException(status_code=500, detail=error_msg)
 
+@app.post("/api/backtest-multiple")
+async def do_backtest_multiple(request: MultipleBacktestRequest, response: Response):
+    """执行多个股票的批量回测并返回结果"""
+    return handle_backtest_multiple(request, response)
+
+@app.get("/api/backtest-multiple")
+def do_backtest_multiple_get(
+    http_request: Request,
+    response: Response,
+    start_date: str,
+    end_date: str,
+    initial_investment: float = 10000,
+    monthly_investment: float = 1000,
+    stocks: List[str] = Query(..., description="每只股票一个参数，格式为 market:stock_code:name")
+):
+    """执行多个股票的批量回测并返回结果（GET 版本，历史区间的结果可被浏览器/CDN 缓存，并支持 If-None-Match）"""
+    stock_infos = []
+    for item in stocks:
+        parts = item.split(':', 2)
+        if len(parts) != 3:
+            raise HTTPException(status_code=400, detail=f"股票参数格式错误: {item}，应为 market:stock_code:name")
+        stock_infos.append(StockInfo(market=parts[0], stock_code=parts[1], name=parts[2]))
+    
+    request = MultipleBacktestRequest(
+        stocks=stock_infos,
+        start_date=start_date,
+        end_date=end_date,
+        initial_investment=initial_investment,
+        monthly_investment=monthly_investment
+    )
+    return handle_backtest_multiple(request, response, http_request)
+
 # --- 静态文件服务 ---
 # 为前端提供静态文件服务
 import os
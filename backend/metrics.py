@@ -0,0 +1,158 @@
+# backend/metrics.py
+import numpy as np
+import pandas as pd
+from typing import Any, Dict, Optional
+
+# 年化使用的交易日数
+TRADING_DAYS_PER_YEAR = 252
+
+def _clean(value: float) -> Optional[float]:
+    """NaN / inf 无法 JSON 序列化，统一转为 None"""
+    value = float(value)
+    return value if np.isfinite(value) else None
+
+def xirr(amounts: np.ndarray, days: np.ndarray, tol: float = 1e-10, max_iter: int = 50) -> float:
+    """
+    计算不规则现金流的年化内部收益率（XIRR）
+    先用牛顿法求解，不收敛时退回二分法
+    :param amounts: 现金流金额，投入为负、取回为正
+    :param days: 每笔现金流距第一笔的天数
+    :param tol: 收敛精度
+    :param max_iter: 牛顿法最大迭代次数
+    :return: 年化收益率（小数），无解时为 NaN
+    """
+    amounts = np.asarray(amounts, dtype=np.float64)
+    years = np.asarray(days, dtype=np.float64) / 365.0
+
+    if not (amounts > 0).any() or not (amounts < 0).any():
+        return np.nan
+
+    def npv(rate: float) -> float:
+        with np.errstate(over='ignore'):
+            return float(np.sum(amounts * np.power(1.0 + rate, -years)))
+
+    # 牛顿法，以简单收益率作为初始值
+    rate = -amounts[amounts > 0].sum() / amounts[amounts < 0].sum() - 1.0
+    rate = min(max(rate, -0.9), 1.0)
+    with np.errstate(over='ignore', divide='ignore', invalid='ignore'):
+        for _ in range(max_iter):
+            discount = np.power(1.0 + rate, -years)
+            value = np.sum(amounts * discount)
+            derivative = np.sum(-years * amounts * discount / (1.0 + rate))
+            if derivative == 0 or not np.isfinite(derivative):
+                break
+            step = value / derivative
+            rate -= step
+            if rate <= -1.0 or not np.isfinite(rate):
+                break
+            if abs(step) < tol:
+                return rate
+
+    # 二分法：先扩大上界直到 NPV 变号
+    low, high = -0.999999, 1.0
+    low_value = npv(low)
+    if low_value < 0:
+        # 期末几乎全部亏损，收益率趋近 -100%
+        return -1.0
+    while npv(high) * low_value > 0:
+        high *= 2
+        if high > 1e6:
+            return np.nan
+    for _ in range(200):
+        mid = (low + high) / 2
+        mid_value = npv(mid)
+        if mid_value * low_value > 0:
+            low, low_value = mid, mid_value
+        else:
+            high = mid
+        if high - low < tol:
+            break
+    return (low + high) / 2
+
+def compute_metrics(
+    dates: pd.DatetimeIndex,
+    equity: np.ndarray,
+    invested: np.ndarray,
+    risk_free_rate: float = 0.0
+) -> Dict[str, Any]:
+    """
+    一次遍历计算定投组合的扩展指标
+    :param dates: 交易日期
+    :param equity: 每日资产净值
+    :param invested: 每日累计投入本金
+    :param risk_free_rate: 年化无风险利率（小数），用于 Sharpe / Sortino
+    :return: 指标字典，无法计算的指标为 None
+    """
+    equity = np.asarray(equity, dtype=np.float64)
+    invested = np.asarray(invested, dtype=np.float64)
+    n = len(equity)
+    if n == 0:
+        raise ValueError("数据为空")
+
+    # 日期转为天数（相对第一天）
+    dates = pd.DatetimeIndex(dates)
+    day_numbers = ((dates - dates[0]) / pd.Timedelta(days=1)).to_numpy(dtype=np.float64)
+
+    # 每日新增投入
+    contributions = np.diff(invested, prepend=0.0)
+
+    # 收益率曲线（相对于当时累计投入）及其回撤，与原有 max_drawdown_pct 口径一致
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return_pct = np.where(invested > 0, (equity / invested - 1) * 100, 0.0)
+    running_max = np.maximum.accumulate(return_pct)
+    drawdown = return_pct - running_max
+    max_drawdown = drawdown.min()
+
+    # 水下时间：距上一次创新高的天数；恢复日也计入所在回撤区间
+    at_high = drawdown >= 0
+    last_high = np.maximum.accumulate(np.where(at_high, np.arange(n), 0))
+    longest_drawdown_days = 0.0
+    if n > 1:
+        in_drawdown = ~at_high[1:] | ~at_high[:-1]
+        durations = day_numbers[1:] - day_numbers[last_high[:-1]]
+        if in_drawdown.any():
+            longest_drawdown_days = durations[in_drawdown].max()
+
+    # 最大回撤的恢复时间：从谷底到重新回到前高的天数，尚未恢复为 None
+    recovery_days = None
+    if max_drawdown < 0:
+        trough = int(np.argmin(drawdown))
+        recovered = np.flatnonzero(at_high[trough:])
+        if len(recovered):
+            recovery_days = float(day_numbers[trough + recovered[0]] - day_numbers[trough])
+
+    # 剔除新增投入后的每日收益率（时间加权）
+    with np.errstate(divide='ignore', invalid='ignore'):
+        daily_returns = (equity[1:] - contributions[1:]) / equity[:-1] - 1
+    daily_returns = daily_returns[np.isfinite(daily_returns)]
+
+    volatility = sharpe = sortino = annualized_return = np.nan
+    if len(daily_returns) > 1:
+        mean = daily_returns.mean()
+        std = daily_returns.std(ddof=1)
+        volatility = std * np.sqrt(TRADING_DAYS_PER_YEAR)
+        annualized_return = np.prod(1 + daily_returns) ** (TRADING_DAYS_PER_YEAR / len(daily_returns)) - 1
+
+        excess = mean - risk_free_rate / TRADING_DAYS_PER_YEAR
+        downside = np.sqrt(np.mean(np.minimum(daily_returns - risk_free_rate / TRADING_DAYS_PER_YEAR, 0) ** 2))
+        if std > 0:
+            sharpe = excess / std * np.sqrt(TRADING_DAYS_PER_YEAR)
+        if downside > 0:
+            sortino = excess / downside * np.sqrt(TRADING_DAYS_PER_YEAR)
+
+    # 资金加权收益率：每笔投入为负现金流，期末净值为正现金流
+    flow_positions = np.flatnonzero(contributions > 0)
+    amounts = np.append(-contributions[flow_positions], equity[-1])
+    flow_days = np.append(day_numbers[flow_positions], day_numbers[-1])
+    money_weighted = xirr(amounts, flow_days)
+
+    return {
+        "xirr_pct": _clean(money_weighted * 100),
+        "annualized_return_pct": _clean(annualized_return * 100),
+        "annualized_volatility_pct": _clean(volatility * 100),
+        "sharpe_ratio": _clean(sharpe),
+        "sortino_ratio": _clean(sortino),
+        "max_drawdown_pct": float(max_drawdown),
+        "longest_drawdown_days": float(longest_drawdown_days),
+        "max_drawdown_recovery_days": recovery_days,
+    }
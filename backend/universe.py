@@ -0,0 +1,384 @@
+# backend/universe.py
+"""
+全市场价格矩阵
+
+把 stocks 表中所有证券的复权收盘价打包成一个 日期 × 证券 的 float32 内存映射文件：
+- 按列（Fortran 顺序）存储，每只证券的价格序列在文件中连续，column() 返回零拷贝视图，
+  批量回测通过 engine.run_backtest_on_column 直接在该视图上运行
+- 日期轴为工作日，某证券当天无交易（节假日、停牌、未上市）时为 NaN
+- 证券 → 列号 的映射按 stocks 表顺序保存在 meta.json 中
+- 每次构建写入 builds/ 下的新目录，完成后原子切换 current 符号链接，
+  读取方始终看到同一次构建的矩阵和 meta.json
+
+用法（在 backend 目录下）：
+    python universe.py build --market US --end 2025-01-01
+    python universe.py scan --years 10 --top 20
+"""
+import os
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import numpy as np
+import pandas as pd
+from datetime import datetime, timezone
+from dateutil.relativedelta import relativedelta
+from typing import Dict, List, Optional, Tuple
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 默认的证券目录数据库和价格矩阵目录
+DEFAULT_DB_PATH = os.path.join(PROJECT_ROOT, 'stocks.db')
+UNIVERSE_DIR = os.getenv('UNIVERSE_DIR', os.path.join(PROJECT_ROOT, 'data', 'universe'))
+
+MATRIX_FILE = 'close.f32'
+META_FILE = 'meta.json'
+BUILDS_DIR = 'builds'
+CURRENT_LINK = 'current'
+
+# 保留的历史构建数（包括当前构建），旧构建可能仍被正在运行的进程读取
+KEEP_BUILDS = 2
+
+# 扫描时向后/向前寻找有效价格的最大工作日数（跨越节假日）
+PRICE_LOOKUP_WINDOW = 10
+
+def load_catalog(db_path: str = DEFAULT_DB_PATH, database_url: Optional[str] = None, market: Optional[str] = None) -> List[Tuple[str, str]]:
+    """
+    从 stocks 表读取证券列表
+    :param db_path: SQLite 证券目录文件（database_url 为空时使用）
+    :param database_url: PostgreSQL 连接串，优先使用
+    :param market: 只读取指定市场，如 'US'、'A-Share'
+    :return: [(yfinance_symbol, market), ...]，按表中顺序去重
+    """
+    query = "SELECT yfinance_symbol, market FROM stocks"
+    if database_url:
+        import psycopg2
+        conn = psycopg2.connect(database_url)
+        params = ()
+        if market:
+            query += " WHERE market = %s"
+            params = (market,)
+        query += " ORDER BY id"
+    else:
+        conn = sqlite3.connect(db_path)
+        params = ()
+        if market:
+            query += " WHERE market = ?"
+            params = (market,)
+        query += " ORDER BY rowid"
+
+    try:
+        cursor = conn.cursor()
+        cursor.execute(query, params)
+        rows = cursor.fetchall()
+    finally:
+        conn.close()
+
+    seen = set()
+    catalog = []
+    for symbol, symbol_market in rows:
+        if symbol and symbol not in seen:
+            seen.add(symbol)
+            catalog.append((symbol, symbol_market))
+    return catalog
+
+def _download_close(symbols: List[str], start_date: str, end_date: str) -> pd.DataFrame:
+    """
+    批量下载一组证券的复权收盘价
+    :return: 日期 × 证券 的 DataFrame，下载失败的证券不在列中
+    """
+    import yfinance as yf
+
+    data = yf.download(
+        symbols,
+        start=start_date,
+        end=end_date,
+        auto_adjust=True,
+        progress=False,
+        threads=True
+    )
+    if data.empty:
+        return pd.DataFrame()
+
+    close = data['Close']
+    if isinstance(close, pd.Series):
+        close = close.to_frame(symbols[0])
+    if close.index.tz is not None:
+        close.index = close.index.tz_localize(None)
+    return close
+
+def build_universe(
+    catalog: List[Tuple[str, str]],
+    start_date: str,
+    end_date: str,
+    out_dir: str = UNIVERSE_DIR,
+    batch_size: int = 200
+) -> str:
+    """
+    下载全部证券的复权收盘价并写入内存映射矩阵
+    按批下载并直接写入对应列，内存占用只与批大小有关
+    :param catalog: load_catalog 的返回值
+    :param start_date: 开始日期
+    :param end_date: 结束日期
+    :param out_dir: 输出目录
+    :param batch_size: 每批下载的证券数
+    :return: 本次构建的目录
+    """
+    if not catalog:
+        raise ValueError("证券列表不能为空")
+
+    # 写入新的构建目录，全部完成后再切换 current，正在读取旧构建的进程不受影响
+    build_id = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S%f')
+    build_dir = os.path.join(out_dir, BUILDS_DIR, build_id)
+    os.makedirs(build_dir)
+
+    dates = pd.bdate_range(start_date, end_date)
+    symbols = [symbol for symbol, _ in catalog]
+    shape = (len(dates), len(symbols))
+
+    matrix = np.memmap(os.path.join(build_dir, MATRIX_FILE), dtype=np.float32, mode='w+', shape=shape, order='F')
+
+    started = time.time()
+    filled = 0
+    for offset in range(0, len(symbols), batch_size):
+        batch = symbols[offset:offset + batch_size]
+        try:
+            close = _download_close(batch, start_date, end_date)
+        except Exception as e:
+            print(f"⚠️ 批次 {offset} 下载失败: {e}")
+            close = pd.DataFrame()
+
+        # 对齐到统一的日期轴和本批的列顺序，缺失值为 NaN
+        close = close.reindex(index=dates, columns=batch)
+        matrix[:, offset:offset + len(batch)] = close.to_numpy(dtype=np.float32)
+        filled += int(close.notna().any().sum())
+
+        done = offset + len(batch)
+        elapsed = time.time() - started
+        print(f"已处理 {done} / {len(symbols)} 个证券，有数据 {filled} 个，{done / elapsed:.1f} 个/秒")
+
+    matrix.flush()
+    del matrix
+
+    meta = {
+        'dtype': 'float32',
+        'order': 'F',
+        'shape': list(shape),
+        'dates': [d.strftime('%Y-%m-%d') for d in dates],
+        'symbols': symbols,
+        'markets': [symbol_market for _, symbol_market in catalog],
+        'built_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+    }
+    with open(os.path.join(build_dir, META_FILE), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, ensure_ascii=False)
+
+    _switch_current(out_dir, build_id)
+    _remove_old_builds(out_dir)
+
+    print(f"✅ 价格矩阵已写入 {build_dir}，{shape[0]} 个交易日 × {shape[1]} 个证券")
+    return build_dir
+
+def _switch_current(out_dir: str, build_id: str) -> None:
+    """先创建临时符号链接再 rename 覆盖 current，切换是原子的"""
+    link_tmp = os.path.join(out_dir, CURRENT_LINK + '.tmp')
+    if os.path.lexists(link_tmp):
+        os.remove(link_tmp)
+    os.symlink(os.path.join(BUILDS_DIR, build_id), link_tmp)
+    os.replace(link_tmp, os.path.join(out_dir, CURRENT_LINK))
+
+def _remove_old_builds(out_dir: str) -> None:
+    """只保留最近 KEEP_BUILDS 次构建（构建目录名按时间排序）"""
+    builds_dir = os.path.join(out_dir, BUILDS_DIR)
+    current = os.path.basename(os.path.realpath(os.path.join(out_dir, CURRENT_LINK)))
+    builds = sorted(os.listdir(builds_dir))
+    for name in builds[:-KEEP_BUILDS]:
+        if name != current:
+            shutil.rmtree(os.path.join(builds_dir, name), ignore_errors=True)
+
+def resolve_universe_dir(directory: str = UNIVERSE_DIR) -> str:
+    """
+    解析价格矩阵目录：包含 current 链接时返回其指向的构建目录，否则认为 directory 本身就是一次构建
+    多个进程应使用同一个解析结果，避免构建切换时读到不同的矩阵
+    """
+    link = os.path.join(directory, CURRENT_LINK)
+    if os.path.lexists(link):
+        return os.path.realpath(link)
+    return directory
+
+class UniversePrices:
+    """只读的全市场价格矩阵，多个进程打开同一文件时共享操作系统页缓存"""
+
+    def __init__(self, directory: str = UNIVERSE_DIR):
+        # 先解析 current 链接，矩阵和 meta.json 从同一个构建目录读取
+        directory = resolve_universe_dir(directory)
+        with open(os.path.join(directory, META_FILE), encoding='utf-8') as f:
+            meta = json.load(f)
+
+        self.directory = directory
+        self.dates = pd.DatetimeIndex(meta['dates'])
+        self.symbols: List[str] = meta['symbols']
+        self.markets: List[str] = meta['markets']
+        self.column_index: Dict[str, int] = {symbol: i for i, symbol in enumerate(self.symbols)}
+        self.matrix = np.memmap(
+            os.path.join(directory, MATRIX_FILE),
+            dtype=meta['dtype'],
+            mode='r',
+            shape=tuple(meta['shape']),
+            order=meta['order']
+        )
+
+    def __contains__(self, symbol: str) -> bool:
+        return symbol in self.column_index
+
+    def __len__(self) -> int:
+        return len(self.symbols)
+
+    def _row_range(self, start_date: Optional[str], end_date: Optional[str]) -> Tuple[int, int]:
+        """日期范围对应的行区间 [start, stop)"""
+        start = self.dates.searchsorted(pd.Timestamp(start_date)) if start_date else 0
+        stop = self.dates.searchsorted(pd.Timestamp(end_date), side='right') if end_date else len(self.dates)
+        return int(start), int(stop)
+
+    def column(self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> np.ndarray:
+        """
+        读取单个证券的价格列（零拷贝视图，包含 NaN）
+        :param symbol: yfinance 格式的代码
+        :param start_date: 开始日期，None 表示从头
+        :param end_date: 结束日期（含），None 表示到最后
+        :return: float32 只读数组，与 self.dates[start:stop] 一一对应
+        """
+        if symbol not in self.column_index:
+            raise KeyError(f"价格矩阵中没有 {symbol}")
+        start, stop = self._row_range(start_date, end_date)
+        return self.matrix[start:stop, self.column_index[symbol]]
+
+    def column_dates(self, start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DatetimeIndex:
+        """与 column() 相同日期范围的日期轴"""
+        start, stop = self._row_range(start_date, end_date)
+        return self.dates[start:stop]
+
+    def frame(self, symbol: str, start_date: Optional[str] = None, end_date: Optional[str] = None) -> pd.DataFrame:
+        """
+        读取单个证券的行情，格式与 yfinance 结果一致（只有 'Close' 列），可直接用于回测引擎
+        日期轴为工作日，几乎所有区间都包含节假日，因此总是复制有效的行；
+        批量计算应使用 column() 和 engine.run_backtest_on_column
+        :return: 以日期为索引的 DataFrame，只包含有交易的日期
+        """
+        values = self.column(symbol, start_date, end_date)
+        dates = self.column_dates(start_date, end_date)
+
+        valid = np.isfinite(values)
+        return pd.DataFrame({'Close': values[valid]}, index=dates[valid])
+
+def _first_valid(block: np.ndarray) -> np.ndarray:
+    """每列第一个有效值，整列都无效时为 NaN"""
+    valid = np.isfinite(block)
+    first = valid.argmax(axis=0)
+    values = block[first, np.arange(block.shape[1])]
+    values[~valid.any(axis=0)] = np.nan
+    return values
+
+def scan_dca_returns(
+    universe: UniversePrices,
+    years: int = 10,
+    end_date: Optional[str] = None,
+    initial_investment: float = 10000,
+    monthly_investment: float = 1000
+) -> pd.DataFrame:
+    """
+    对全部证券同时计算定投收益（每次只读取投资日附近的几行，不逐只加载）
+    投资日为每月同一天之后的第一个工作日，当天无价格时顺延到该证券的下一个交易日；
+    与逐只回测相比只在节假日附近有细微差别，适合全市场筛选
+    :param universe: 价格矩阵
+    :param years: 回看年数
+    :param end_date: 结束日期，None 表示矩阵最后一天
+    :param initial_investment: 初始投资金额
+    :param monthly_investment: 每月定投金额
+    :return: 按收益率降序排列的 DataFrame（symbol, market, total_invested, final_total, total_return_pct）
+    """
+    end = pd.Timestamp(end_date) if end_date else universe.dates[-1]
+    start = end - relativedelta(years=years)
+    row_start, row_stop = universe._row_range(start.strftime('%Y-%m-%d'), end.strftime('%Y-%m-%d'))
+    if row_stop - row_start < 30:
+        raise ValueError("数据长度不足，至少需要30个数据点")
+
+    # 计算每月投资日对应的行号
+    targets = []
+    current = universe.dates[row_start]
+    while current <= universe.dates[row_stop - 1]:
+        targets.append(current)
+        current = current + relativedelta(months=1)
+    rows = np.unique(universe.dates.searchsorted(pd.DatetimeIndex(targets)))
+    rows = rows[rows < row_stop]
+
+    matrix = universe.matrix
+    n_symbols = matrix.shape[1]
+    shares = np.zeros(n_symbols)
+    invested = np.zeros(n_symbols)
+
+    # 只有在起始日已经有价格的证券才参与比较
+    eligible = None
+    for i, row in enumerate(rows):
+        price = _first_valid(matrix[row:min(row + PRICE_LOOKUP_WINDOW, row_stop), :]).astype(np.float64)
+        if eligible is None:
+            eligible = np.isfinite(price)
+        amount = initial_investment if i == 0 else monthly_investment
+        bought = np.isfinite(price) & eligible
+        shares[bought] += amount / price[bought]
+        invested[bought] += amount
+
+    # 最终价格取区间末尾最近一个有效价格
+    tail = matrix[max(row_stop - PRICE_LOOKUP_WINDOW, row_start):row_stop, :][::-1]
+    final_price = _first_valid(tail).astype(np.float64)
+
+    ok = eligible & np.isfinite(final_price) & (invested > 0)
+    final_total = shares[ok] * final_price[ok]
+    result = pd.DataFrame({
+        'symbol': np.asarray(universe.symbols, dtype=object)[ok],
+        'market': np.asarray(universe.markets, dtype=object)[ok],
+        'total_invested': invested[ok],
+        'final_total': final_total,
+        'total_return_pct': (final_total / invested[ok] - 1) * 100,
+    })
+    return result.sort_values('total_return_pct', ascending=False, ignore_index=True)
+
+def main():
+    parser = argparse.ArgumentParser(description="全市场价格矩阵构建与扫描")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    build = subparsers.add_parser('build', help="下载全部证券价格并构建内存映射矩阵")
+    build.add_argument('--db', default=DEFAULT_DB_PATH, help="SQLite 证券目录文件")
+    build.add_argument('--database-url', default=None, help="PostgreSQL 连接串（优先于 --db）")
+    build.add_argument('--market', default=None, help="只构建指定市场，如 US、A-Share")
+    build.add_argument('--start', default='1990-01-01', help="开始日期")
+    build.add_argument('--end', required=True, help="结束日期")
+    build.add_argument('--out', default=UNIVERSE_DIR, help="输出目录")
+    build.add_argument('--batch-size', type=int, default=200, help="每批下载的证券数")
+
+    scan = subparsers.add_parser('scan', help="扫描全部证券的定投收益")
+    scan.add_argument('--dir', default=UNIVERSE_DIR, help="价格矩阵目录")
+    scan.add_argument('--years', type=int, default=10, help="回看年数")
+    scan.add_argument('--end', default=None, help="结束日期")
+    scan.add_argument('--initial', type=float, default=10000, help="初始投资金额")
+    scan.add_argument('--monthly', type=float, default=1000, help="每月定投金额")
+    scan.add_argument('--top', type=int, default=20, help="显示前 N 名")
+    scan.add_argument('--output', default=None, help="将完整结果写入 CSV 文件")
+
+    args = parser.parse_args()
+
+    if args.command == 'build':
+        catalog = load_catalog(args.db, args.database_url, args.market)
+        print(f"共 {len(catalog)} 个证券")
+        build_universe(catalog, args.start, args.end, args.out, args.batch_size)
+    else:
+        started = time.time()
+        universe = UniversePrices(args.dir)
+        result = scan_dca_returns(universe, args.years, args.end, args.initial, args.monthly)
+        print(f"扫描 {len(universe)} 个证券，{len(result)} 个有完整数据，用时 {time.time() - started:.2f} 秒")
+        print(result.head(args.top).to_string())
+        if args.output:
+            result.to_csv(args.output, index=False)
+
+if __name__ == "__main__":
+    main()